@@ -54,10 +54,9 @@ def find_industry_pe_ratio():
 
 
 def write_list_to_txt(lst: list, title: str):
+    # one single write instead of one per item
     with open(f'{title}.txt', 'w+') as f:
-        for items in lst:
-            f.write('%s\n' %items)
-    f.close()
+        f.write(''.join('%s\n' % items for items in lst))
 
 
 def get_ticker_info(ticker: str):
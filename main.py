@@ -6,6 +6,11 @@ import csv
 import yfinance as yf
 import metrics
 import functions
+import prices
+import output
+import sweep
+import ttm
+import scheduler
 
 warnings.filterwarnings('ignore')
 pd.set_option('display.max_columns', None)
@@ -34,8 +39,15 @@ Step 0: if check_piotroski_score is True, the code loops through a list of ticke
         created manually with just a few stocks; 
         if check_undervalued_stocks is True, the code will create a list from a file containing the highest 
         ranked tickers and will loop through searching for undervalued tickers (pb_ratio between 0 and 1, peg
-        between 0 and 1.5) 
-        
+        between 0 and 1.5);
+        if ttm_mode is True, Steps 1-4 are replaced by the TTM scores computed from the quarterly statements 
+        (cached in QuarterlyCache, see ttm.py) and the last quarter is used instead of the last year. Until the 
+        cache holds 8 quarters the previous year comes from the annual statements (see the warm-up in ttm.py);
+        if schedule_by_priority is True, the tickers are sorted so that the previous best scores come first and
+        those which failed too many times in a row are skipped for some days (see scheduler.py); with a 
+        time_budget in seconds the sweep stops when the time is over (in TTM mode between two chunks of 
+        tickers), the time needed to find the first hits is printed at the end;
+
 Step 1: call the function get_fundamentals to download the data for the three statements and check the last 
         available year and how many years are shown;
 
@@ -51,13 +63,25 @@ Step 4: the scores will be contained in the dictionary scores to compute the val
         If a stock has all valid metrics and six of them are positive the score will be 6/9; if the valid metrics
         are seven and the positive ones are only 4, the score will be 4/7;
 
-Step 5: the ticker will be printed out along with the Piotroski score, while only the best tickers can 
-        be stored into a txt file named HighestScore_ (uncomment the code at the end of Step 5);
+Step 5: every ticker is written as a row (score, the 9 metrics) to the output sinks (CSV and JSONL files named
+        PiotroskiScores, add a ParquetSink if pyarrow is installed), while only the best tickers can 
+        be stored into a txt file named HighestScore_ (uncomment the code at the end of Step 5). Details are 
+        printed to screen only if verbose is True, otherwise just a summary at the end. The tickers not scored 
+        in this run (time budget, skipped or failed) keep their previous row in PiotroskiScores;
 
 Step 6: download the average PE ratio per industry;
 
 Step 7: for each of the tickers with the highest scores it will be calculated Price/Book ratio, PE ratio and
-        PEG ratio to checker whether it is undervalued. If so, it will be printed to screen;
+        PEG ratio to checker whether it is undervalued. If so, it will be written to the UndervaluedStocks sinks
+        along with its 9 metrics (when computed in Step 5). Every checked ticker is written to the Valuations file;
+
+Step 8: if check_price_overlay is True, update the price-history store (one batched download for all the tickers, 
+        only the new days after the first run) and show momentum, volatility and max drawdown for the best tickers;
+
+Step 9: if check_threshold_sweep is True, load the stored scores and valuations and evaluate every combination
+        of the cutoffs in the grid (score, P/B bounds, PE vs industry, PEG cap) without downloading again. The 
+        shortlist size (also after the score cutoffs alone, since only the tickers checked in Step 7 have the
+        valuation fields) and the tickers of each combination are written to ThresholdSweep.csv;
 
 """
 
@@ -81,6 +105,8 @@ Step 7: for each of the tickers with the highest scores it will be calculated Pr
 
 my_file = pd.read_csv("/Users/madararubino/Downloads/nyse_tickers.csv")
 ticker_list = my_file["Symbol"].tolist()
+# keep the whole list, ticker_list can be replaced in Step 7
+all_tickers = list(ticker_list)
 
 best_stocks = []
 
@@ -88,20 +114,82 @@ best_stocks = []
 # set check_undervalued_stocks to True to find undervalued tickers among those with the highest Piotroski rank
 check_piotroski_score = False
 check_undervalued_stocks = True
+# set check_price_overlay to True to add momentum, volatility and drawdown to the best tickers
+check_price_overlay = False
+price_store = "PriceHistory"
+# set ttm_mode to True to compute the score on the trailing twelve months from the quarterly statements
+ttm_mode = False
+# set schedule_by_priority to True to fetch first the tickers most likely to have a high score
+schedule_by_priority = True
+# seconds after which the sweep stops (None: no limit)
+time_budget = None
+# set check_threshold_sweep to True to see how the shortlist changes with different cutoffs
+check_threshold_sweep = False
+# set verbose to True to print every ticker and the details of the best ones
+verbose = False
+# rows of the scored tickers, used to add the 9 metrics to the undervalued ones
+score_rows = {}
 
 if check_piotroski_score:
-    for ticker_to_use in ticker_list:
-        print(ticker_to_use)
+    # read the previous results before the sinks replace them
+    previous_rows = output.read_rows("PiotroskiScores.csv")
+    fetch_failures = scheduler.read_failures()
+    if schedule_by_priority:
+        ticker_list, skipped_tickers = scheduler.order_tickers(ticker_list, failures=fetch_failures)
+        if verbose:
+            print("Skipped tickers: " + str(skipped_tickers))
+
+    score_sinks = [output.CsvSink("PiotroskiScores.csv"), output.JsonlSink("PiotroskiScores.jsonl"),
+                   output.ConsoleSink(verbose=False, title="Scored tickers")]
+    # written straight to the file in small batches: the best stocks are on disk soon after they are found
+    best_sinks = [output.CsvSink("BestStocks.csv", batch_size=10, replace=False),
+                  output.ConsoleSink(verbose=verbose, title="No. of best stocks")]
+    timer = scheduler.HitTimer(time_budget)
+
+    if ttm_mode:
+        # fetched and scored in chunks in the scheduled order, the time budget is checked between chunks
+        for ttm_scores in ttm.iter_scores(ticker_list):
+            for ticker_to_use, values in ttm_scores.iterrows():
+                if pd.isna(values["Last Quarter"]):  # no quarterly data, as in the annual loop
+                    scheduler.record_failure(fetch_failures, ticker_to_use)
+                    continue
+                scheduler.record_success(fetch_failures, ticker_to_use)
+                row = output.make_row(ticker_to_use, last_year=values["Last Quarter"],
+                                      piotroski_score=values["Piotroski Score"],
+                                      positive_scores=values["Positive Scores"],
+                                      valid_scores=values["Valid Scores"],
+                                      **{s.replace(" ", "_").lower(): values[s] for s in output.SIGNALS})
+                output.write_rows(score_sinks, row)
+                score_rows[ticker_to_use] = row
+                pos_scores, valid_scores = values["Positive Scores"], values["Valid Scores"]
+                if int(pos_scores) >= 8 or (int(valid_scores) == 8 and int(pos_scores) >= 7):
+                    best_stocks.append(ticker_to_use)
+                    timer.hit(ticker_to_use)
+                    output.write_rows(best_sinks, row)
+            if timer.expired():
+                print("Time budget over, stopped after " + ttm_scores.index[-1])
+                break
+        # the annual loop below is skipped
+        annual_tickers = []
+    else:
+        annual_tickers = ticker_list
+
+    for ticker_to_use in annual_tickers:
+        if timer.expired():
+            print("Time budget over, stopped before " + ticker_to_use)
+            break
+        if verbose:
+            print(ticker_to_use)
         # download data and split it into 3 variables: income statement, balance sheet and cash flow
         # set two variables with the last year available and how many years of data for that ticker
-        if functions.get_fundamentals(ticker_to_use)[0]:
-            inc_stat, balance_sheet, cash_flow, last_year, years = functions.get_fundamentals(ticker_to_use)[1], \
-                                                                   functions.get_fundamentals(ticker_to_use)[2], \
-                                                                   functions.get_fundamentals(ticker_to_use)[3], \
-                                                                   functions.get_fundamentals(ticker_to_use)[4], \
-                                                                   functions.get_fundamentals(ticker_to_use)[5]
+        fundamentals = functions.get_fundamentals(ticker_to_use)
+        if fundamentals[0]:
+            inc_stat, balance_sheet, cash_flow, last_year, years = fundamentals[1:6]
+            scheduler.record_success(fetch_failures, ticker_to_use)
         else:  # no data for the ticker or missing years
-            print("Missing data! Impossible to compute the metrics")
+            scheduler.record_failure(fetch_failures, ticker_to_use)
+            if verbose:
+                print("Missing data! Impossible to compute the metrics")
             continue
 
 
@@ -203,7 +291,7 @@ if check_piotroski_score:
                 "Asset Turnover PY": asset_turnover_py
             }
 
-        elif functions.get_fundamentals(ticker_to_use)[4] == current_year:  # "2024":
+        elif last_year == current_year:  # "2024":
             # try to extract the values that will be used to compute the 9 metrics
             if years == 4:
                 try:
@@ -299,7 +387,8 @@ if check_piotroski_score:
                 "Asset Turnover PY": asset_turnover_py
             }
         else:
-            print("Last year is neither 2023 nor 2024")
+            if verbose:
+                print("Last year is neither 2023 nor 2024")
 
         # Step 3
         columns_to_delete = ["Net Income", "Return On Assets CY", "Return On Assets PY", "Oper Cash Flow", \
@@ -381,24 +470,34 @@ if check_piotroski_score:
         increase_gross_margin = df._get_value(0, "Increase in Gross Margin")
         increase_asset_turnover = df._get_value(0, "Increase in Asset Turnover")
 
+        row = output.make_row(ticker_to_use, last_year=last_year, piotroski_score=piotroski_score,
+                              positive_scores=pos_scores, valid_scores=valid_scores,
+                              positive_net_income=pos_net_income, positive_return_on_assets=pos_roa,
+                              positive_oper_cash_flow=pos_oper_cashflow,
+                              oper_cash_flow_higher_than_net_income=oper_cashflow_vs_net_income,
+                              decrease_in_leverage=decrease_leverage,
+                              increase_in_current_ratio=increase_current_ratio,
+                              no_shares_issued=no_shares_issued, increase_in_gross_margin=increase_gross_margin,
+                              increase_in_asset_turnover=increase_asset_turnover)
+        output.write_rows(score_sinks, row)
+        score_rows[ticker_to_use] = row
+
         if int(pos_scores) >= 8 or (int(valid_scores) == 8 and int(pos_scores) >= 7):
             best_stocks.append(ticker_to_use)
-            print("\n" + ticker_to_use + " based on year: " + str(last_year))
-            print("PIOTROSKI SCORE: " + str(piotroski_score))
-            print("Positive Net Income: " + str(pos_net_income))
-            print("Positive ROA: " + str(pos_roa))
-            print("Positive Cash Flow: " + str(pos_oper_cashflow))
-            print("Cash Flow vs Net Income: " + str(oper_cashflow_vs_net_income))
-            print("Decrease Leverage: " + str(decrease_leverage))
-            print("Increased Current Ratio: " + str(increase_current_ratio))
-            print("No shares issued: " + str(no_shares_issued))
-            print("Increase Gross Margin: " + str(increase_gross_margin))
-            print("Increase Asset Turnover: " + str(increase_asset_turnover) + "\n")
+            timer.hit(ticker_to_use)
+            output.write_rows(best_sinks, row)
         # else:
         #     print(ticker_to_use + ": " + str(piotroski_score) + "\n")
 
-    print("No. of best stocks: " + str(len(best_stocks)))
-    print(best_stocks)
+    # keep the previous rows of the tickers not scored in this run (time budget, skipped or failed)
+    for ticker_to_use, row in previous_rows.items():
+        if ticker_to_use not in score_rows:
+            output.write_rows(score_sinks[:2], row)
+    output.close_sinks(score_sinks + best_sinks)
+    scheduler.write_failures(fetch_failures)
+    print(timer.summary())
+    if verbose:
+        print(best_stocks)
     # uncomment to write a list of the best stocks to a text file
     # file_name = "HighestScore_NYSE_NASDAQ"
     # functions.write_list_to_txt(best_stocks, file_name)
@@ -410,6 +509,10 @@ undervalued_stocks = []
 
 # Step 7
 if check_undervalued_stocks:
+    undervalued_sinks = [output.CsvSink("UndervaluedStocks.csv"), output.JsonlSink("UndervaluedStocks.jsonl"),
+                         output.ConsoleSink(verbose=verbose, title="Undervalued stocks")]
+    valuation_sinks = [output.CsvSink("Valuations.csv")]
+
     # Uncomment to open a txt file and create a list of tickers
     # my_file = open("HighestScore_NYSE_NASDAQ.txt")
     # data = my_file.read()
@@ -456,20 +559,41 @@ if check_undervalued_stocks:
         else:
             avg_pe_ratio = float(industry_pe_ratio[industry])
 
-        # print to screen tickers with P/B ratio between 0 and 1 and
+        row = output.make_row(t, industry=industry, sector=sector, country=country, price=price,
+                              book_value=bookValue, price_book_ratio=pb_ratio, pe_ratio=trailingpe,
+                              industry_pe_ratio=avg_pe_ratio, peg_ratio=peg)
+        row.update({k: v for k, v in score_rows.get(t, {}).items() if k not in output.VALUATION})
+        output.write_rows(valuation_sinks, row)
+
+        # write tickers with P/B ratio between 0 and 1 and
         # the PE ratio lower than the industry average
         if pb_ratio and (0 < pb_ratio < 1) and trailingpe and avg_pe_ratio and (trailingpe < avg_pe_ratio):
-            print(t)
-            print("Industry: " + industry + " - " + "Sector: " + sector + " - " + "Country: " + country)
-            print("Price: " + str(price) + " - " "Book Value: " + str(bookValue))
-            print("Price/Book ratio: " + str(pb_ratio))
-            print("PE Ratio is: " + str(trailingpe) + " - Industry Avg: " + str(avg_pe_ratio))
-            print("PEG Ratio is: " + str(peg) + "\n")
+            output.write_rows(undervalued_sinks, row)
             undervalued_stocks.append(t)
         else:
             continue
 
-print(undervalued_stocks)
+    output.close_sinks(undervalued_sinks + valuation_sinks)
+
+if verbose:
+    print(undervalued_stocks)
+
+# Step 8
+if check_price_overlay:
+    overlay_tickers = best_stocks if best_stocks else undervalued_stocks
+    prices.update_price_store(price_store, all_tickers)
+    overlay = prices.price_overlay(price_store, overlay_tickers)
+    print(overlay.sort_values("Momentum", ascending=False))
+
+# Step 9
+if check_threshold_sweep:
+    sweep_table = sweep.load_sweep_table("PiotroskiScores.csv", "Valuations.csv")
+    grid = sweep.make_grid(min_score=[6, 7, 8, 9], min_score_8_valid=[6, 7, 8],
+                           pb_low=[0.0, 0.2], pb_high=[0.8, 1.0, 1.2, 1.5, 2.0],
+                           pe_multiplier=[0.6, 0.8, 1.0, 1.2], peg_cap=[1.0, 1.5, 2.0, np.inf])
+    sweep_result, sweep_masks = sweep.evaluate_grid(sweep_table, grid)
+    sweep.write_sweep(sweep_table, sweep_result, sweep_masks, "ThresholdSweep")
+    print(sweep_result.sort_values("Shortlist Size", ascending=False).head(20))
 
 def print_hi(name):
     # Use a breakpoint in the code line below to debug your script.
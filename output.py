@@ -0,0 +1,253 @@
+import abc
+import csv
+import json
+import os
+import sys
+import numpy as np
+
+"""
+Output layer for the screener. Every ticker becomes one row (a dictionary with the keys in FIELDS)
+which is handed to one or more sinks. A sink keeps the rows in a buffer and writes them in batches
+of batch_size, so a run over 20k tickers does only a few hundred writes. Call close() (or use the
+sink in a with statement) to write the last rows.
+
+Sinks: CsvSink, JsonlSink, ParquetSink (needs pyarrow) and ConsoleSink, which prints only a short
+summary at the end unless verbose is True. The file sinks write to {path}.tmp and replace the file
+at path only in close(), so the results of the previous run can be read until then. A CsvSink
+with replace=False writes straight to path instead and flushes every batch, so the rows are on
+disk even if the run is killed.
+"""
+
+SIGNALS = ["Positive Net Income", "Positive Return On Assets", "Positive Oper Cash Flow",
+           "Oper Cash Flow higher than Net Income", "Decrease in Leverage", "Increase in Current Ratio",
+           "No Shares Issued", "Increase in Gross Margin", "Increase in Asset Turnover"]
+
+VALUATION = ["Industry", "Sector", "Country", "Price", "Book Value", "Price/Book Ratio", "PE Ratio",
+             "Industry PE Ratio", "PEG Ratio"]
+
+FIELDS = ["Ticker", "Last Year", "Piotroski Score", "Positive Scores", "Valid Scores"] + SIGNALS + VALUATION
+
+# fields which are always text, the others are numbers
+TEXT_FIELDS = ["Ticker", "Last Year", "Piotroski Score", "Industry", "Sector", "Country"]
+
+
+def make_row(ticker: str, **values) -> dict:
+    """
+    This function will create a row with all the FIELDS, the missing ones are None.
+    The keyword names are the fields with spaces and slashes replaced by underscores,
+    e.g. last_year="2024", price_book_ratio=0.8
+    :param ticker: ticker name as a string
+    :return: a dictionary field/value
+    """
+    row = dict.fromkeys(FIELDS)
+    row["Ticker"] = ticker
+    keys = {f.replace(" ", "_").replace("/", "_").lower(): f for f in FIELDS}
+    for key, value in values.items():
+        row[keys[key]] = _to_python(value)
+
+    return row
+
+
+def _to_python(value):
+    # numpy scalars and NaN are not JSON serializable
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class Sink(abc.ABC):
+    """
+    Base class of the sinks: it collects the rows and calls _write_batch every batch_size rows.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+
+    def write(self, row: dict):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._write_batch(self.buffer)
+            self.rows_written += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    @abc.abstractmethod
+    def _write_batch(self, rows: list):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvSink(Sink):
+    def __init__(self, path: str, batch_size: int = 1000, replace: bool = True):
+        super().__init__(batch_size)
+        self.path = path
+        self.replace = replace
+        self.file = open(path + '.tmp' if replace else path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        self.writer.writeheader()
+        if not replace:
+            self.file.flush()
+
+    def _write_batch(self, rows: list):
+        self.writer.writerows(rows)
+        if not self.replace:
+            self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+        if self.replace:
+            os.replace(self.path + '.tmp', self.path)
+
+
+class JsonlSink(Sink):
+    def __init__(self, path: str, batch_size: int = 1000):
+        super().__init__(batch_size)
+        self.path = path
+        self.file = open(path + '.tmp', 'w')
+
+    def _write_batch(self, rows: list):
+        self.file.write(''.join(json.dumps(row) + '\n' for row in rows))
+
+    def close(self):
+        super().close()
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ParquetSink(Sink):
+    def __init__(self, path: str, batch_size: int = 5000):
+        super().__init__(batch_size)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("ParquetSink needs pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.path = path
+        self.writer = None
+        # fixed schema, otherwise a batch with only None in a column would not match the others
+        integers = ["Positive Scores", "Valid Scores"] + SIGNALS
+        self.schema = pa.schema([(f, pa.string() if f in TEXT_FIELDS else pa.int64() if f in integers
+                                  else pa.float64()) for f in FIELDS])
+        self.pq = pq
+
+    def _write_batch(self, rows: list):
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path + '.tmp', self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self.writer is None:  # no rows: still write an empty file
+            self.writer = self.pq.ParquetWriter(self.path + '.tmp', self.schema)
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ConsoleSink(Sink):
+    """
+    If verbose is True it prints every row with format_row (the header used so far with the year
+    and the Piotroski score, then one line per field), otherwise it only counts the rows and
+    prints a compact summary when closed.
+    """
+
+    def __init__(self, verbose: bool = False, title: str = "Rows", batch_size: int = 100):
+        # verbose: every row is printed right away, after the ticker printed by the loop
+        super().__init__(1 if verbose else batch_size)
+        self.verbose = verbose
+        self.title = title
+        self.tickers = []
+        self.scores = {}
+
+    def _write_batch(self, rows: list):
+        lines = []
+        for row in rows:
+            self.tickers.append(row["Ticker"])
+            if row["Piotroski Score"] is not None:
+                self.scores[row["Piotroski Score"]] = self.scores.get(row["Piotroski Score"], 0) + 1
+            if self.verbose:
+                lines.append(format_row(row))
+        if lines:
+            sys.stdout.write(''.join(lines))
+            sys.stdout.flush()
+
+    def close(self):
+        super().close()
+        summary = self.title + ": " + str(len(self.tickers))
+        if self.scores:
+            summary += " - " + ", ".join(k + ": " + str(v) for k, v in sorted(self.scores.items(), reverse=True))
+        sys.stdout.write(summary + "\n")
+        sys.stdout.flush()
+
+
+def format_row(row: dict) -> str:
+    """
+    The detailed text of one row: the ticker with the year and the Piotroski score as printed
+    so far, then the other fields which are not None
+    :param row: a dictionary created by make_row
+    :return: a string ending with an empty line
+    """
+    lines = ["\n" + row["Ticker"]]
+    if row["Last Year"] is not None:
+        lines[0] += " based on year: " + str(row["Last Year"])
+    if row["Piotroski Score"] is not None:
+        lines.append("PIOTROSKI SCORE: " + str(row["Piotroski Score"]))
+    for field in FIELDS[5:]:
+        if row[field] is not None:
+            lines.append(field + ": " + str(row[field]))
+
+    return "\n".join(lines) + "\n\n"
+
+
+def read_rows(path: str) -> dict:
+    """
+    This function will read the rows written by a CsvSink, e.g. the results of the previous run
+    :param path: the csv file
+    :return: a dictionary ticker/row, empty if the file does not exist
+    """
+    if not os.path.exists(path):
+        return {}
+    rows = {}
+    with open(path, 'r', newline='') as f:
+        for values in csv.DictReader(f):
+            row = dict.fromkeys(FIELDS)
+            for field in FIELDS:
+                if values.get(field) not in (None, ''):
+                    row[field] = values[field] if field in TEXT_FIELDS else _from_csv(values[field])
+            rows[row["Ticker"]] = row
+    return rows
+
+
+def _from_csv(value: str):
+    # csv stores everything as text: restore the numbers
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def write_rows(sinks: list, row: dict):
+    for sink in sinks:
+        sink.write(row)
+
+
+def close_sinks(sinks: list):
+    for sink in sinks:
+        sink.close()
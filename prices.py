@@ -0,0 +1,298 @@
+import os
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+"""
+Price-history store used for the price-based overlays (momentum, volatility, drawdown) on the
+Piotroski shortlist.
+
+The close prices are kept as a dense date x ticker float32 matrix written as raw bytes into
+{name}.dat, one row per trading day. Two text files sit next to it: {name}_tickers.txt (the
+column order, fixed when the store is created) and {name}_dates.txt (one line per row).
+Because rows are appended at the end of the file, a daily update only writes the new rows,
+and any other process can open the matrix read-only with np.memmap without copying it.
+Missing prices are stored as NaN.
+
+The prices are adjusted for splits and dividends, which changes the whole history of a ticker
+after every event. Each update downloads again the last overlap_days stored rows: the tickers
+whose overlapping prices do not match the stored ones anymore are downloaded from the first
+stored date and their columns are rewritten in place.
+"""
+
+
+def _store_paths(name: str):
+    return f'{name}.dat', f'{name}_tickers.txt', f'{name}_dates.txt'
+
+
+def _read_lines(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def download_prices(tickers: list, start=None, end=None, batch_size: int = 500) -> list:
+    """
+    This function will download the daily close prices for many tickers at once, splitting
+    the list into batches so that every request to yfinance contains batch_size tickers.
+    :param tickers: a list of tickers
+    :param start: first date to download (string "YYYY-MM-DD" or None for 2 years of data, enough for
+                  the 12-1 month momentum which needs more than 252 rows)
+    :param end: last date to download (excluded), None for today
+    :param batch_size: number of tickers per request
+    :return: [a dataframe with dates as index and tickers as columns (float32, NaN if missing),
+              a list of the tickers without any price (failed request or no data)]
+    """
+    frames = []
+    failed_batches = 0
+    for i in range(0, len(tickers), batch_size):
+        batch = tickers[i:i + batch_size]
+        try:
+            if start is None:
+                data = yf.download(batch, period="2y", end=end, auto_adjust=True,
+                                   progress=False, threads=True, group_by="column")
+            else:
+                data = yf.download(batch, start=start, end=end, auto_adjust=True,
+                                   progress=False, threads=True, group_by="column")
+        except Exception as e:
+            print("Price download failed for " + str(len(batch)) + " tickers: " + str(e))
+            failed_batches += 1
+            continue
+        if data is None or data.empty:
+            continue
+        close = data["Close"]
+        if isinstance(close, pd.Series):  # a batch with a single ticker
+            close = close.to_frame(name=batch[0])
+        frames.append(close)
+
+    if not frames:
+        return [pd.DataFrame(columns=tickers, dtype=np.float32), list(tickers)]
+
+    prices = pd.concat(frames, axis=1)
+    prices = prices.loc[:, ~prices.columns.duplicated()]
+    prices.index = pd.to_datetime(prices.index).tz_localize(None).normalize()
+    prices = prices.reindex(columns=tickers).astype(np.float32)
+    failed = prices.columns[prices.isna().all()].tolist()
+
+    return [prices, failed]
+
+
+def create_price_store(name: str, prices: pd.DataFrame):
+    """
+    This function will create a new store (overwriting an existing one with the same name)
+    from a dataframe of prices. The columns of the dataframe set the ticker order for good.
+    :param name: path of the store without extension, e.g. "prices/nyse"
+    :param prices: a dataframe with dates as index and tickers as columns
+    :return: the number of rows written
+    """
+    if prices.empty:
+        raise ValueError("No prices to store in " + name)
+    data_path, tickers_path, dates_path = _store_paths(name)
+    matrix = np.ascontiguousarray(prices.to_numpy(dtype=np.float32))
+    matrix.tofile(data_path)
+
+    with open(tickers_path, 'w') as f:
+        f.write(''.join('%s\n' % t for t in prices.columns))
+    with open(dates_path, 'w') as f:
+        f.write(''.join('%s\n' % d.strftime('%Y-%m-%d') for d in pd.to_datetime(prices.index)))
+
+    return len(matrix)
+
+
+def append_prices(name: str, prices: pd.DataFrame):
+    """
+    This function will append to the store only the dates which are more recent than the
+    last stored date. Tickers which are not in the store are ignored, stored tickers missing
+    from prices will get NaN.
+    :param name: path of the store without extension
+    :param prices: a dataframe with dates as index and tickers as columns
+    :return: the number of rows appended
+    """
+    data_path, tickers_path, dates_path = _store_paths(name)
+    tickers = _read_lines(tickers_path)
+    dates = _read_lines(dates_path)
+
+    prices = prices.copy()
+    prices.index = pd.to_datetime(prices.index)
+    if dates:
+        prices = prices[prices.index > pd.Timestamp(dates[-1])]
+    if prices.empty:
+        return 0
+
+    matrix = np.ascontiguousarray(prices.reindex(columns=tickers).to_numpy(dtype=np.float32))
+    with open(data_path, 'ab') as f:
+        matrix.tofile(f)
+    with open(dates_path, 'a') as f:
+        f.write(''.join('%s\n' % d.strftime('%Y-%m-%d') for d in prices.index))
+
+    return len(matrix)
+
+
+def readjust_prices(name: str, prices: pd.DataFrame, batch_size: int = 500, tolerance: float = 1e-3):
+    """
+    This function will compare the downloaded prices with the stored ones on the common dates.
+    A ticker whose prices differ by more than tolerance (a split or a dividend changed the
+    adjusted history) is downloaded from the first stored date and its column is rewritten.
+    :param name: path of the store without extension
+    :param prices: a dataframe with dates as index and tickers as columns
+    :return: the list of the rewritten tickers
+    """
+    matrix, tickers, dates = load_price_store(name, mode='r+')
+    stored_dates = pd.to_datetime(dates)
+    common = stored_dates.isin(prices.index)
+    if not common.any():
+        return []
+
+    stored = np.asarray(matrix[common])
+    new = prices.reindex(index=stored_dates[common], columns=tickers).to_numpy(dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        changed = (np.abs(new / stored - 1) > tolerance).any(axis=0)
+    changed_tickers = [t for t, c in zip(tickers, changed) if c]
+    if not changed_tickers:
+        return []
+
+    end = (stored_dates[-1] + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    history, failed = download_prices(changed_tickers, start=dates[0], end=end, batch_size=batch_size)
+    rewritten = [t for t in changed_tickers if t not in failed]
+    columns = [tickers.index(t) for t in rewritten]
+    matrix[:, columns] = history.reindex(index=stored_dates, columns=rewritten).to_numpy(dtype=np.float32)
+    matrix.flush()
+
+    return rewritten
+
+
+def update_price_store(name: str, tickers: list, batch_size: int = 500, overlap_days: int = 5):
+    """
+    This function will create the store if it does not exist yet (two years of data),
+    otherwise it will download the last overlap_days stored days and the new ones, fix the
+    tickers whose adjusted history changed and append the new days.
+    Nothing is stored when the download fails for all the tickers.
+    :param name: path of the store without extension
+    :param tickers: a list of tickers, used only when the store is created
+    :return: the number of rows written
+    """
+    data_path, tickers_path, dates_path = _store_paths(name)
+    if not os.path.exists(data_path):
+        prices, failed = download_prices(tickers, batch_size=batch_size)
+        if failed:
+            print("No prices for " + str(len(failed)) + " of " + str(len(tickers)) + " tickers")
+        if prices.empty:
+            return 0
+        return create_price_store(name, prices)
+
+    tickers = _read_lines(tickers_path)
+    dates = _read_lines(dates_path)
+    start = dates[-overlap_days] if len(dates) >= overlap_days else (dates[0] if dates else None)
+    prices, failed = download_prices(tickers, start=start, batch_size=batch_size)
+    if failed:
+        print("No prices for " + str(len(failed)) + " of " + str(len(tickers)) + " tickers")
+    if prices.empty:
+        return 0
+
+    rewritten = readjust_prices(name, prices, batch_size=batch_size)
+    if rewritten:
+        print("Adjusted history rewritten for: " + str(rewritten))
+
+    return append_prices(name, prices)
+
+
+def load_price_store(name: str, mode: str = 'r'):
+    """
+    This function will open the store as a memory-mapped matrix, nothing is read into
+    memory until the values are used.
+    :param name: path of the store without extension
+    :param mode: 'r' read-only (default) or 'r+' to edit the values in place
+    :return: matrix (dates x tickers, float32), list of tickers, list of dates
+    """
+    data_path, tickers_path, dates_path = _store_paths(name)
+    tickers = _read_lines(tickers_path)
+    dates = _read_lines(dates_path)
+    if not dates or not tickers:
+        return np.empty((0, len(tickers)), dtype=np.float32), tickers, dates
+    matrix = np.memmap(data_path, dtype=np.float32, mode=mode, shape=(len(dates), len(tickers)))
+
+    return matrix, tickers, dates
+
+
+def compute_returns(prices: np.ndarray, periods: int = 1) -> np.ndarray:
+    """
+    Simple returns over the given number of rows for all tickers at once.
+    :param prices: a dates x tickers matrix
+    :param periods: distance in trading days
+    :return: a matrix with periods fewer rows than prices
+    """
+    prices = np.asarray(prices, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return prices[periods:] / prices[:-periods] - 1
+
+
+def compute_momentum(prices: np.ndarray, lookback: int = 252, skip: int = 21) -> np.ndarray:
+    """
+    Momentum as the return from lookback days ago up to skip days ago (12-1 month by default).
+    :param prices: a dates x tickers matrix
+    :param lookback: number of trading days to look back
+    :param skip: most recent trading days to leave out
+    :return: an array with one value per ticker (NaN if not enough data)
+    """
+    prices = np.asarray(prices, dtype=np.float32)
+    if len(prices) <= max(lookback, skip):
+        return np.full(prices.shape[1], np.nan, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return prices[-1 - skip] / prices[-1 - lookback] - 1
+
+
+def compute_volatility(prices: np.ndarray, window: int = 63, annualize: bool = True) -> np.ndarray:
+    """
+    Standard deviation of the daily returns over the last window days.
+    :param prices: a dates x tickers matrix
+    :param window: number of trading days
+    :param annualize: multiply by the square root of 252
+    :return: an array with one value per ticker
+    """
+    prices = np.asarray(prices, dtype=np.float32)
+    if len(prices) < 2:
+        return np.full(prices.shape[1], np.nan, dtype=np.float32)
+    returns = compute_returns(prices[-window - 1:])
+    volatility = np.nanstd(returns, axis=0)
+    if annualize:
+        volatility = volatility * np.sqrt(252)
+
+    return volatility.astype(np.float32)
+
+
+def compute_max_drawdown(prices: np.ndarray, window: int = 252) -> np.ndarray:
+    """
+    Largest drop from a running peak over the last window days, as a negative number.
+    :param prices: a dates x tickers matrix
+    :param window: number of trading days
+    :return: an array with one value per ticker
+    """
+    prices = np.asarray(prices, dtype=np.float32)[-window:]
+    if len(prices) == 0:
+        return np.full(prices.shape[1], np.nan, dtype=np.float32)
+    # carry the peak over the missing days
+    peaks = np.fmax.accumulate(prices, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = prices / peaks - 1
+
+    return np.nanmin(drawdowns, axis=0)
+
+
+def price_overlay(name: str, tickers: list, lookback: int = 252, skip: int = 21,
+                  window: int = 63) -> pd.DataFrame:
+    """
+    This function will compute momentum, volatility and max drawdown for all the tickers in
+    the store and will return only those in the given list.
+    :param name: path of the store without extension
+    :param tickers: a list of tickers, e.g. the best stocks
+    :return: a dataframe with the tickers as index
+    """
+    matrix, stored_tickers, dates = load_price_store(name)
+    overlay = pd.DataFrame({
+        "Momentum": compute_momentum(matrix, lookback, skip),
+        "Volatility": compute_volatility(matrix, window),
+        "Max Drawdown": compute_max_drawdown(matrix, lookback),
+    }, index=stored_tickers)
+
+    return overlay.reindex(tickers)
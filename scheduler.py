@@ -0,0 +1,165 @@
+import os
+import time
+import pandas as pd
+
+"""
+Order of the sweep: the tickers most likely to have a high score are fetched first, so in a
+time-boxed run they are always scored and they show up at the top of the output files.
+
+The priority of a ticker comes from cheap information already on disk:
+- membership in the HighestScore_*.txt files;
+- the last stored score (Positive Scores / Valid Scores in the PiotroskiScores file);
+- data freshness: the period of the stored score ("Last Year", a year in the annual mode or a
+  quarter in TTM mode), the closer to the most recent period in the file the higher the bonus;
+- past fetch failures (FetchFailures.csv): every failure in a row lowers the priority and the
+  tickers which failed max_failures times in a row are skipped for retry_days days after their
+  last failure, then they are fetched again (a failure can be a network or rate-limit error).
+
+Read the previous results before any output sink is created: the sinks replace their files.
+"""
+
+
+def read_ticker_file(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        data = f.read()
+    data_into_list = data.replace('\n', ', ').split(", ")
+    return list(filter(None, data_into_list))
+
+
+def read_failures(path: str = "FetchFailures.csv") -> dict:
+    """
+    :param path: csv file with columns Ticker, Failures, Last Failure
+    :return: a dictionary ticker/[number of failures in a row, date of the last failure]
+    """
+    if not os.path.exists(path):
+        return {}
+    failures = pd.read_csv(path)
+    return {t: [n, d] for t, n, d in zip(failures["Ticker"], failures["Failures"], failures["Last Failure"])}
+
+
+def write_failures(failures: dict, path: str = "FetchFailures.csv"):
+    failures = {t: v for t, v in failures.items() if v[0] > 0}
+    pd.DataFrame({"Ticker": list(failures.keys()),
+                  "Failures": [v[0] for v in failures.values()],
+                  "Last Failure": [v[1] for v in failures.values()]}).to_csv(path, index=False)
+
+
+def record_failure(failures: dict, ticker: str):
+    count = failures.get(ticker, [0, None])[0]
+    failures[ticker] = [count + 1, pd.Timestamp.today().strftime('%Y-%m-%d')]
+
+
+def record_success(failures: dict, ticker: str):
+    failures.pop(ticker, None)
+
+
+def ticker_priority(tickers: list, highest_files: list = None, scores_path: str = "PiotroskiScores.csv",
+                    failures: dict = None) -> pd.Series:
+    """
+    This function will compute the priority of every ticker, the higher the sooner it is fetched.
+    :param tickers: a list of tickers
+    :param highest_files: txt files with the best tickers of the previous runs
+    :param scores_path: results of the previous runs (csv written by output.CsvSink)
+    :param failures: a dictionary created by read_failures
+    :return: a series with the tickers as index
+    """
+    if highest_files is None:
+        highest_files = ["HighestScore_NYSE_NASDAQ.txt", "HighestScore_AllYahooFinance.txt"]
+    failures = failures or {}
+    priority = pd.Series(0.0, index=pd.Index(tickers).drop_duplicates())
+
+    highest = set()
+    for path in highest_files:
+        highest.update(read_ticker_file(path))
+    priority[priority.index.isin(highest)] += 10
+
+    try:
+        scores = pd.read_csv(scores_path, usecols=["Ticker", "Last Year", "Positive Scores", "Valid Scores"],
+                             dtype={"Last Year": str})
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        scores = None
+    if scores is not None:
+        scores = scores.drop_duplicates(subset="Ticker", keep="last").set_index("Ticker")
+        ratio = (scores["Positive Scores"] / scores["Valid Scores"]).reindex(priority.index)
+        priority += ratio.fillna(0.5) * 5
+
+        # up to 2 points for the most recent period, less 0.5 per quarter older
+        quarters = scores["Last Year"].map(_to_quarter).astype(float)
+        bonus = (2 - 0.5 * (quarters.max() - quarters)).clip(lower=0)
+        priority += bonus.reindex(priority.index).fillna(0)
+
+    counts = pd.Series({t: v[0] for t, v in failures.items()}, dtype=float)
+    priority -= 3 * counts.reindex(priority.index).fillna(0)
+
+    return priority
+
+
+def _to_quarter(last_year):
+    # number of quarters since year 0: "2024" is the last quarter of the year, "2025Q2" a quarter
+    if not isinstance(last_year, str) or not last_year:
+        return None
+    try:
+        year, quarter = last_year.split('Q') if 'Q' in last_year else (last_year, 4)
+        return int(year) * 4 + int(quarter) - 1
+    except ValueError:
+        return None
+
+
+def order_tickers(tickers: list, max_failures: int = 3, retry_days: int = 7, **kwargs):
+    """
+    This function will sort the tickers by priority (the file order is kept for equal priority)
+    and will leave out those which failed max_failures times in a row, unless their last
+    failure is older than retry_days days.
+    :param tickers: a list of tickers
+    :param max_failures: number of failures after which a ticker is skipped, None to keep all
+    :param retry_days: days after the last failure before a skipped ticker is fetched again
+    :return: the ordered list of tickers and the list of skipped tickers
+    """
+    failures = kwargs.get("failures") or {}
+    priority = ticker_priority(tickers, **kwargs)
+    ordered = priority.sort_values(ascending=False, kind="stable").index.tolist()
+    if max_failures is None:
+        return ordered, []
+
+    retry_from = pd.Timestamp.today().normalize() - pd.Timedelta(days=retry_days)
+    skipped = [t for t in ordered if failures.get(t, [0, None])[0] >= max_failures
+               and pd.Timestamp(failures[t][1]) > retry_from]
+    skipped_set = set(skipped)
+
+    return [t for t in ordered if t not in skipped_set], skipped
+
+
+class HitTimer:
+    """
+    It measures the time from the start of the sweep to every hit (a ticker with a high score)
+    and it tells when the time budget is over.
+    """
+
+    def __init__(self, time_budget: float = None):
+        self.start = time.perf_counter()
+        self.time_budget = time_budget
+        self.hits = []
+
+    def hit(self, ticker: str):
+        self.hits.append((ticker, time.perf_counter() - self.start))
+
+    def expired(self) -> bool:
+        return self.time_budget is not None and time.perf_counter() - self.start > self.time_budget
+
+    def time_to_first(self, n: int):
+        """
+        :return: seconds needed to find the first n hits, None if there are fewer hits
+        """
+        if len(self.hits) < n:
+            return None
+        return self.hits[n - 1][1]
+
+    def summary(self, checkpoints=(1, 10, 50)) -> str:
+        parts = []
+        for n in checkpoints:
+            seconds = self.time_to_first(n)
+            if seconds is not None:
+                parts.append("first " + str(n) + ": " + str(round(seconds, 1)) + "s")
+        return "Time to hits - " + (", ".join(parts) if parts else "no hits")
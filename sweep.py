@@ -0,0 +1,124 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+"""
+Sensitivity of the shortlist to the screening cutoffs, computed from the stored results without
+downloading anything again.
+
+The rules are the ones used in main.py:
+- Step 5: pos_scores >= min_score or (valid_scores == 8 and pos_scores >= min_score_8_valid)
+- Step 7: pb_low < pb_ratio < pb_high and trailingpe < pe_multiplier * industry PE and peg <= peg_cap
+
+Every combination of the parameters is a point of the grid. All the points are evaluated at once
+with NumPy broadcasting (points x tickers boolean matrix), in chunks to keep the memory bounded.
+
+The valuation fields exist only for the tickers checked in Step 7, every other ticker has no P/B
+or PE and never passes the valuation filters. For this reason the size of the shortlist after the
+score cutoffs alone is reported in its own column, "Score Shortlist Size", together with
+"Valued Tickers", the number of tickers of that stage which have the valuation fields.
+"""
+
+GRID_COLUMNS = ["min_score", "min_score_8_valid", "pb_low", "pb_high", "pe_multiplier", "peg_cap"]
+
+
+def _read_rows(path: str) -> pd.DataFrame:
+    if path.endswith('.jsonl'):
+        return pd.read_json(path, lines=True)
+    elif path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def load_sweep_table(scores_path: str, valuations_path: str = None) -> pd.DataFrame:
+    """
+    This function will read the rows written by the output sinks and will merge the scores
+    (Step 5) with the valuation fields (Step 7) on the ticker.
+    :param scores_path: PiotroskiScores file (csv, jsonl or parquet)
+    :param valuations_path: Valuations file, None if the scores file has the valuation fields too
+    :return: a dataframe with one row per ticker
+    """
+    table = _read_rows(scores_path)
+    if valuations_path:
+        valuations = _read_rows(valuations_path)
+        valuation_columns = ["Ticker", "Price/Book Ratio", "PE Ratio", "Industry PE Ratio", "PEG Ratio"]
+        table = table.drop(columns=valuation_columns[1:], errors='ignore')
+        table = table.merge(valuations[valuation_columns], on="Ticker", how="left")
+
+    return table.drop_duplicates(subset="Ticker", keep="last").reset_index(drop=True)
+
+
+def make_grid(min_score=(8,), min_score_8_valid=(7,), pb_low=(0.0,), pb_high=(1.0,),
+              pe_multiplier=(1.0,), peg_cap=(np.inf,)) -> pd.DataFrame:
+    """
+    This function will create all the combinations of the given values.
+    The defaults are the cutoffs currently used in main.py (no PEG filter).
+    :return: a dataframe with one row per grid point and the columns in GRID_COLUMNS
+    """
+    points = list(itertools.product(min_score, min_score_8_valid, pb_low, pb_high, pe_multiplier, peg_cap))
+
+    return pd.DataFrame(points, columns=GRID_COLUMNS)
+
+
+def evaluate_grid(table: pd.DataFrame, grid: pd.DataFrame, chunk_size: int = 2048):
+    """
+    This function will compute which tickers pass the screen for every point of the grid.
+    A missing value (NaN) never passes a filter, except PEG when peg_cap is infinite.
+    :param table: a dataframe created by load_sweep_table
+    :param grid: a dataframe created by make_grid
+    :param chunk_size: grid points evaluated in the same pass
+    :return: the grid with the new columns "Score Shortlist Size", "Valued Tickers" and
+             "Shortlist Size" and a boolean matrix grid points x tickers
+    """
+    pos = table["Positive Scores"].to_numpy(dtype=np.float64)[None, :]
+    valid = table["Valid Scores"].to_numpy(dtype=np.float64)[None, :]
+    pb = table["Price/Book Ratio"].to_numpy(dtype=np.float64)[None, :]
+    pe = table["PE Ratio"].to_numpy(dtype=np.float64)[None, :]
+    industry_pe = table["Industry PE Ratio"].to_numpy(dtype=np.float64)[None, :]
+    peg = table["PEG Ratio"].to_numpy(dtype=np.float64)[None, :]
+    # a missing PEG passes only when there is no PEG cap
+    peg = np.where(np.isnan(peg), np.inf, peg)
+
+    params = {c: grid[c].to_numpy(dtype=np.float64)[:, None] for c in GRID_COLUMNS}
+    valued = ~np.isnan(pb) & ~np.isnan(pe) & ~np.isnan(industry_pe)
+    masks = np.empty((len(grid), len(table)), dtype=bool)
+    score_sizes = np.empty(len(grid), dtype=np.int64)
+    valued_sizes = np.empty(len(grid), dtype=np.int64)
+
+    for start in range(0, len(grid), chunk_size):
+        p = {c: v[start:start + chunk_size] for c, v in params.items()}
+        with np.errstate(invalid='ignore'):
+            mask = (pos >= p["min_score"]) | ((valid == 8) & (pos >= p["min_score_8_valid"]))
+            score_sizes[start:start + chunk_size] = mask.sum(axis=1)
+            valued_sizes[start:start + chunk_size] = (mask & valued).sum(axis=1)
+            mask &= (pb > p["pb_low"]) & (pb < p["pb_high"])
+            mask &= pe < p["pe_multiplier"] * industry_pe
+            mask &= (peg <= p["peg_cap"]) | np.isinf(p["peg_cap"])
+        masks[start:start + chunk_size] = mask
+
+    result = grid.copy()
+    result["Score Shortlist Size"] = score_sizes
+    result["Valued Tickers"] = valued_sizes
+    result["Shortlist Size"] = masks.sum(axis=1)
+
+    return result, masks
+
+
+def shortlist(table: pd.DataFrame, masks: np.ndarray, point: int) -> list:
+    """
+    The tickers which pass the screen for one point of the grid
+    :param point: row number of the grid
+    :return: a list of tickers
+    """
+    return table["Ticker"].to_numpy()[masks[point]].tolist()
+
+
+def write_sweep(table: pd.DataFrame, result: pd.DataFrame, masks: np.ndarray, title: str):
+    """
+    This function will write the grid with the shortlist size and the tickers of each point to a csv file
+    :param title: name of the file without extension
+    """
+    tickers = table["Ticker"].to_numpy()
+    report = result.copy()
+    report["Tickers"] = [" ".join(tickers[m]) for m in masks]
+    report.to_csv(f'{title}.csv', index=False)
@@ -0,0 +1,282 @@
+import os
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import metrics
+from output import SIGNALS
+
+"""
+Trailing-twelve-month (TTM) mode: the Piotroski score computed from the quarterly statements
+instead of the annual ones, so the score moves every quarter and there is no check on the last
+year being 2023 or 2024.
+
+The quarterly values of each ticker are cached in {cache_dir}/{ticker}.csv (columns Date, Item,
+Value) and new quarters are merged into it, so the cache keeps more history than the 4-5 quarters
+returned by yfinance. The same file keeps the date of the last download attempt (Item FETCH).
+A ticker is downloaded again only when a new quarter can be available, and then at most once
+every retry_days days until it shows up (once every stale_retry_days days for a ticker which has
+not filed for more than a year), so every new quarter costs a few small fetches per ticker.
+
+All the tickers are aligned into one panel (quarters x tickers for each item):
+- flows (Net Income, Gross Profit, Total Revenue, Operating Cash Flow) are summed over the last
+  4 quarters with a rolling window, a missing quarter gives a missing TTM value;
+- balance sheet items are taken at the end of the quarter.
+CY is the last quarter with a TTM Net Income, PY is the same quarter one year earlier.
+
+Warm-up: a TTM value for PY needs 8 consecutive quarters, while yfinance returns only 4-5, so
+the cache needs about one year of updates before PY comes from the quarters alone. Until then
+(and whenever a PY quarter is missing) PY is taken from the annual statements, cached too: the
+last fiscal year ending in the PY quarter or at most 3 quarters before it. Without annual data
+either, the PY signals are missing and the score has fewer valid metrics.
+"""
+
+FLOW_ITEMS = ["Net Income", "Gross Profit", "Total Revenue", "Operating Cash Flow"]
+BALANCE_ITEMS = ["Total Assets", "Long Term Debt", "Current Assets", "Current Liabilities", "Share Issued"]
+# the annual values are cached with this prefix, e.g. "Annual Net Income"
+ANNUAL = "Annual "
+# cache row with the date of the last download attempt
+FETCH = "Last Fetch"
+
+
+def get_quarterly_statements(ticker: str, annual: bool = True) -> list:
+    """
+    This function will download the quarterly income statement, balance sheet and cash flow
+    and, if annual is True, the annual ones too (needed only during the warm-up). Only the
+    items used by the 9 metrics are kept, the annual items get the prefix ANNUAL.
+    :param ticker: ticker name as a string
+    :param annual: download the annual statements as well
+    :return: [True, a dataframe with columns Date, Item, Value] else [False, []]
+    """
+    try:
+        stock_data = yf.Ticker(ticker)
+        statements = [(stock_data.quarterly_income_stmt, ""), (stock_data.quarterly_balance_sheet, ""),
+                      (stock_data.quarterly_cashflow, "")]
+        if annual:
+            statements += [(stock_data.income_stmt, ANNUAL), (stock_data.balance_sheet, ANNUAL),
+                           (stock_data.cashflow, ANNUAL)]
+    except Exception as e:
+        return [False, []]
+
+    frames = []
+    for statement, prefix in statements:
+        if statement is None or len(statement.columns) == 0:
+            continue
+        items = [i for i in statement.index if i in metrics.fundamentals]
+        long = statement.loc[items].T.stack().reset_index()
+        long.columns = ["Date", "Item", "Value"]
+        long["Item"] = prefix + long["Item"]
+        frames.append(long)
+    if not frames or all(f["Item"].str.startswith(ANNUAL).all() for f in frames):
+        return [False, []]
+
+    data = pd.concat(frames, ignore_index=True).dropna(subset=["Value"])
+    data["Date"] = pd.to_datetime(data["Date"]).dt.strftime('%Y-%m-%d')
+
+    return [True, data]
+
+
+def _cache_path(cache_dir: str, ticker: str) -> str:
+    return os.path.join(cache_dir, f'{ticker}.csv')
+
+
+def read_cache(ticker: str, cache_dir: str = "QuarterlyCache") -> pd.DataFrame:
+    path = _cache_path(cache_dir, ticker)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["Date", "Item", "Value"])
+    return pd.read_csv(path, dtype={"Date": str, "Item": str, "Value": float})
+
+
+def needs_update(cached: pd.DataFrame, today=None, days: int = 100, retry_days: int = 7,
+                 stale_days: int = 400, stale_retry_days: int = 90) -> bool:
+    """
+    A new quarter can be available only if the last cached quarter ended more than
+    days ago (one quarter plus the time needed to file it). Until it is available the ticker
+    is downloaded again only retry_days days after the last attempt, or stale_retry_days days
+    if the last quarter ended more than stale_days days ago (a ticker which does not file anymore).
+    :param cached: the cached dataframe of a ticker, with the FETCH row
+    :return: True if the ticker must be downloaded again
+    """
+    today = pd.Timestamp.today() if today is None else pd.Timestamp(today)
+    fetches = cached.loc[cached["Item"] == FETCH, "Date"]
+    since_fetch = (today - pd.Timestamp(fetches.max())).days if len(fetches) else None
+    data = cached[cached["Item"] != FETCH]
+
+    if data.empty:
+        return since_fetch is None or since_fetch > retry_days
+    since_quarter = (today - pd.Timestamp(data["Date"].max())).days
+    if since_quarter <= days:
+        return False
+    if since_fetch is None:
+        return True
+    return since_fetch > (stale_retry_days if since_quarter > stale_days else retry_days)
+
+
+def needs_annual(cached: pd.DataFrame) -> bool:
+    """
+    The annual statements are needed only while the cache has fewer than 8 quarters of Net Income
+    (the warm-up, see above)
+    """
+    return (cached["Item"] == "Net Income").sum() < 8
+
+
+def update_cache(ticker: str, cache_dir: str = "QuarterlyCache", force: bool = False) -> pd.DataFrame:
+    """
+    This function will download the quarterly statements only if a new quarter can be
+    available and will merge them into the cache (the downloaded values win). The date of the
+    attempt is stored even if the download fails.
+    :param ticker: ticker name as a string
+    :param force: download even if the cache is recent
+    :return: the cached values of the ticker (without the FETCH row)
+    """
+    cached = read_cache(ticker, cache_dir)
+    if not force and not needs_update(cached):
+        return cached[cached["Item"] != FETCH]
+
+    downloaded = get_quarterly_statements(ticker, annual=needs_annual(cached))
+    fetch = pd.DataFrame({"Date": [pd.Timestamp.today().strftime('%Y-%m-%d')], "Item": [FETCH],
+                          "Value": [np.nan]})
+    frames = [cached[cached["Item"] != FETCH], fetch]
+    if downloaded[0]:
+        frames.insert(1, downloaded[1])
+
+    merged = pd.concat(frames, ignore_index=True)
+    merged = merged.drop_duplicates(subset=["Date", "Item"], keep="last").sort_values(["Date", "Item"])
+    os.makedirs(cache_dir, exist_ok=True)
+    merged.to_csv(_cache_path(cache_dir, ticker), index=False)
+
+    return merged[merged["Item"] != FETCH]
+
+
+def build_panel(data: dict) -> dict:
+    """
+    This function will align the quarters of all the tickers.
+    Dates are converted to calendar quarters, so fiscal quarters ending in different
+    months of the same quarter share one row.
+    :param data: a dictionary ticker/cached dataframe
+    :return: a dictionary item/dataframe (quarters x tickers) with all the consecutive quarters,
+             the annual values are in the quarter where the fiscal year ends
+    """
+    frames = [df[df["Item"] != FETCH].assign(Ticker=t) for t, df in data.items()]
+    frames = [df for df in frames if not df.empty]
+    tickers = list(data.keys())
+    all_items = FLOW_ITEMS + BALANCE_ITEMS + [ANNUAL + i for i in FLOW_ITEMS + BALANCE_ITEMS]
+    if not frames:
+        return {item: pd.DataFrame(columns=tickers, dtype=float) for item in all_items}
+
+    long = pd.concat(frames, ignore_index=True)
+    long["Quarter"] = pd.to_datetime(long["Date"]).dt.to_period('Q')
+    wide = long.pivot_table(index="Quarter", columns=["Item", "Ticker"], values="Value", aggfunc="last")
+    quarters = pd.period_range(wide.index.min(), wide.index.max(), freq='Q')
+
+    panel = {}
+    for item in all_items:
+        if item in wide.columns.get_level_values(0):
+            frame = wide[item]
+        else:
+            frame = pd.DataFrame(index=wide.index, dtype=float)
+        panel[item] = frame.reindex(index=quarters, columns=tickers).astype(float)
+
+    return panel
+
+
+def ttm_panel(panel: dict) -> dict:
+    """
+    Rolling 4 quarters sum for the flows, the balance sheet items are left as they are.
+    The annual values are carried forward for 3 quarters, so they can replace a missing PY.
+    :param panel: a dictionary created by build_panel
+    :return: a new dictionary item/dataframe
+    """
+    ttm = dict(panel)
+    for item in FLOW_ITEMS:
+        ttm[item] = panel[item].rolling(4, min_periods=4).sum()
+    for item in FLOW_ITEMS + BALANCE_ITEMS:
+        ttm[ANNUAL + item] = panel[ANNUAL + item].ffill(limit=3)
+
+    return ttm
+
+
+def compute_ttm_scores(panel: dict) -> pd.DataFrame:
+    """
+    This function will compute the 9 metrics for all the tickers at once, with 1, 0 or NaN
+    if the data is missing, as in Step 3 of main.py.
+    :param panel: a dictionary created by build_panel (not yet TTM)
+    :return: a dataframe with the tickers as index, the 9 metrics, "Positive Scores",
+             "Valid Scores", "Piotroski Score" and "Last Quarter"
+    """
+    ttm = ttm_panel(panel)
+    net_income = ttm["Net Income"].to_numpy()
+    quarters, tickers = net_income.shape
+    columns = np.arange(tickers)
+
+    # last quarter with a TTM net income for each ticker, -1 if there is none
+    has_data = ~np.isnan(net_income)
+    if quarters == 0:  # no ticker with cached data: all the metrics are missing
+        last = np.full(tickers, -1)
+    else:
+        last = np.where(has_data.any(axis=0), quarters - 1 - np.argmax(has_data[::-1], axis=0), -1)
+    prev = last - 4
+
+    def at(item, rows):
+        values = ttm[item].to_numpy()
+        out = np.full(tickers, np.nan)
+        ok = rows >= 0
+        out[ok] = values[rows[ok], columns[ok]]
+        return out
+
+    cy = {item: at(item, last) for item in FLOW_ITEMS + BALANCE_ITEMS}
+    # PY from the quarters, else from the last fiscal year (see the warm-up above)
+    py = {item: at(item, prev) for item in FLOW_ITEMS + BALANCE_ITEMS}
+    for item in FLOW_ITEMS + BALANCE_ITEMS:
+        py[item] = np.where(np.isnan(py[item]), at(ANNUAL + item, prev), py[item])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roa_cy = cy["Net Income"] / cy["Total Assets"]
+        roa_py = py["Net Income"] / py["Total Assets"]
+        current_ratio_cy = cy["Current Assets"] / cy["Current Liabilities"]
+        current_ratio_py = py["Current Assets"] / py["Current Liabilities"]
+        gross_margin_cy = cy["Gross Profit"] / cy["Total Revenue"]
+        gross_margin_py = py["Gross Profit"] / py["Total Revenue"]
+        asset_turnover_cy = cy["Total Revenue"] / cy["Total Assets"]
+        asset_turnover_py = py["Total Revenue"] / py["Total Assets"]
+
+    def signal(condition, *values):
+        missing = np.zeros(tickers, dtype=bool)
+        for v in values:
+            missing |= ~np.isfinite(v)
+        return np.where(missing, np.nan, condition.astype(float))
+
+    with np.errstate(invalid='ignore'):
+        scores = pd.DataFrame({
+            SIGNALS[0]: signal(cy["Net Income"] > 0, cy["Net Income"]),
+            SIGNALS[1]: signal(roa_cy > roa_py, roa_cy, roa_py),
+            SIGNALS[2]: signal(cy["Operating Cash Flow"] > 0, cy["Operating Cash Flow"]),
+            SIGNALS[3]: signal(cy["Operating Cash Flow"] > cy["Net Income"], cy["Operating Cash Flow"],
+                               cy["Net Income"]),
+            SIGNALS[4]: signal(cy["Long Term Debt"] < py["Long Term Debt"], cy["Long Term Debt"],
+                               py["Long Term Debt"]),
+            SIGNALS[5]: signal(current_ratio_cy > current_ratio_py, current_ratio_cy, current_ratio_py),
+            SIGNALS[6]: signal(cy["Share Issued"] <= py["Share Issued"], cy["Share Issued"], py["Share Issued"]),
+            SIGNALS[7]: signal(gross_margin_cy > gross_margin_py, gross_margin_cy, gross_margin_py),
+            SIGNALS[8]: signal(asset_turnover_cy > asset_turnover_py, asset_turnover_cy, asset_turnover_py),
+        }, index=ttm["Net Income"].columns)
+
+    scores["Positive Scores"] = (scores[SIGNALS] == 1).sum(axis=1)
+    scores["Valid Scores"] = scores[SIGNALS].notna().sum(axis=1)
+    scores["Piotroski Score"] = scores["Positive Scores"].astype(str) + "/" + scores["Valid Scores"].astype(str)
+    period_index = ttm["Net Income"].index
+    scores["Last Quarter"] = [str(period_index[q]) if q >= 0 else None for q in last]
+
+    return scores
+
+
+def iter_scores(tickers: list, cache_dir: str = "QuarterlyCache", chunk_size: int = 50):
+    """
+    This function will update the cache and compute the TTM scores chunk_size tickers at a
+    time, so that the results of the first tickers are available before the others are fetched
+    and the caller can stop between two chunks.
+    :param tickers: a list of tickers, in the order they must be fetched
+    :return: a generator of dataframes created by compute_ttm_scores, one per chunk
+    """
+    for start in range(0, len(tickers), chunk_size):
+        data = {t: update_cache(t, cache_dir) for t in tickers[start:start + chunk_size]}
+        yield compute_ttm_scores(build_panel(data))